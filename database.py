@@ -5,11 +5,11 @@ MongoDB helper functions ready to use in your backend code.
 Import and use these functions in your API endpoints for database operations.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from typing import Optional, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
@@ -21,12 +21,26 @@ db = None
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+
+def connect_db():
+    """Open the shared Motor client (call once at application startup)"""
+    global _client, db
+    if _client is None and database_url and database_name:
+        # tz_aware so datetimes read back match the UTC-aware ones we write
+        _client = AsyncIOMotorClient(database_url, tz_aware=True)
+        db = _client[database_name]
+    return db
+
+def close_db():
+    """Close the shared Motor client (call once at application shutdown)"""
+    global _client, db
+    if _client is not None:
+        _client.close()
+    _client = None
+    db = None
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -37,13 +51,14 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     else:
         data_dict = data.copy()
 
-    data_dict['created_at'] = datetime.now(timezone.utc)
-    data_dict['updated_at'] = datetime.now(timezone.utc)
+    # Keep caller-supplied timestamps so callers can cache exactly what was stored
+    data_dict.setdefault('created_at', datetime.now(timezone.utc))
+    data_dict.setdefault('updated_at', data_dict['created_at'])
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(collection_name: str, filter_dict: Optional[dict] = None, limit: Optional[int] = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +67,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=None)
@@ -1,16 +1,54 @@
+import asyncio
+import base64
+import logging
 import os
-import random
-import string
-from typing import Optional
+import secrets
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Annotated, Any, AsyncIterator, Optional
 
-from fastapi import FastAPI, HTTPException
+from cachetools import LRUCache, TTLCache
+from fastapi import BackgroundTasks, FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse
+from pydantic import AfterValidator, BaseModel, Field
+from pymongo.errors import DuplicateKeyError
 
-from database import db, create_document
-from schemas import Room, Participant
+import database
+from database import create_document
+from schemas import Participant
 
-app = FastAPI(title="AvatarMeet API")
+logger = logging.getLogger(__name__)
+
+# Keep well under Gunicorn's 30s worker timeout
+_INDEX_TIMEOUT_S = 10
+
+
+async def _ensure_room_indexes(db: Any) -> None:
+    # Rooms created before code became _id still have ObjectId keys; the code
+    # index serves lookups for both and keeps new codes from colliding with them
+    try:
+        await asyncio.wait_for(db["room"].create_index("code", unique=True), timeout=_INDEX_TIMEOUT_S)
+    except Exception:
+        logger.warning("Could not create unique index on room.code; new codes may collide with legacy rooms", exc_info=True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    # One Motor client (and connection pool) shared by every request. Created here,
+    # after Gunicorn forks, because an event loop cannot be shared across processes.
+    db = database.connect_db()
+    # Build indexes in the background so an unreachable DB cannot stall startup
+    index_task = asyncio.create_task(_ensure_room_indexes(db)) if db is not None else None
+    try:
+        yield
+    finally:
+        if index_task is not None:
+            index_task.cancel()
+        database.close_db()
+
+
+app = FastAPI(title="AvatarMeet API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,18 +58,43 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Fallback in-memory store when database quota blocks writes (non-persistent)
-FALLBACK_ROOMS: dict[str, dict] = {}
+# A room document as stored in MongoDB, minus its _id
+RoomDoc = dict[str, Any]
+
+# Rooms are immutable once created, so every room written or read is kept here.
+# The same bounded cache is the only copy when database quota blocks writes;
+# such rooms, like _fallback_active, exist only in the worker that created them.
+_ROOM_CACHE: LRUCache[str, RoomDoc] = LRUCache(maxsize=50_000)
+_fallback_active: bool = False
+
+# Room lookups currently in flight, so concurrent misses for one code share a query
+_INFLIGHT: dict[str, "asyncio.Future[Optional[RoomDoc]]"] = {}
+
+# /test is polled by health probes: read config once, list collections at most every 5s
+_DATABASE_URL_SET: bool = bool(database.database_url)
+_DATABASE_NAME: Optional[str] = database.database_name
+_COLLECTIONS_CACHE: TTLCache[str, list[str]] = TTLCache(maxsize=1, ttl=5)
+
 
+async def _cached_collections(db: Any) -> list[str]:
+    collections = _COLLECTIONS_CACHE.get("names")
+    if collections is None:
+        collections = await db.list_collection_names()
+        _COLLECTIONS_CACHE["names"] = collections
+    return collections
 
-@app.get("/")
-def read_root():
+
+# Handlers pass response_model=None so their return annotations don't turn into
+# response models that FastAPI would re-validate on every response
+
+@app.get("/", response_model=None)
+def read_root() -> dict[str, str]:
     return {"message": "AvatarMeet backend running"}
 
 
-@app.get("/test")
-def test_database():
-    response = {
+@app.get("/test", response_model=None)
+async def test_database() -> dict[str, Any]:
+    response: dict[str, Any] = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
         "database_url": "❌ Not Set",
@@ -41,13 +104,14 @@ def test_database():
         "fallback_active": False,
     }
     try:
+        db = database.db
         if db is not None:
             response["database"] = "✅ Available"
-            response["database_url"] = "✅ Set" if os.getenv("DATABASE_URL") else "❌ Not Set"
-            response["database_name"] = os.getenv("DATABASE_NAME") or "❌ Not Set"
+            response["database_url"] = "✅ Set" if _DATABASE_URL_SET else "❌ Not Set"
+            response["database_name"] = _DATABASE_NAME or "❌ Not Set"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await _cached_collections(db)
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -56,14 +120,20 @@ def test_database():
             response["database"] = "⚠️  Available but not initialized"
     except Exception as e:
         response["database"] = f"❌ Error: {str(e)[:80]}"
-    response["fallback_active"] = len(FALLBACK_ROOMS) > 0
+    response["fallback_active"] = _fallback_active
     return response
 
 
 # --------------------- Rooms API ---------------------
+# Room codes are case-insensitive; normalize once while validating input
+RoomCode = Annotated[str, AfterValidator(str.upper)]
+
+
 class CreateRoomRequest(BaseModel):
     scene: Optional[str] = "classroom"
-    max_participants: Optional[int] = 16
+    # schemas.Room's upper bound, checked here since the insert skips Room;
+    # 0 is allowed because create_room maps it to the default of 16
+    max_participants: Optional[int] = Field(16, ge=0, le=64)
 
 
 class CreateRoomResponse(BaseModel):
@@ -72,7 +142,7 @@ class CreateRoomResponse(BaseModel):
 
 
 class JoinRoomRequest(BaseModel):
-    code: str
+    code: RoomCode
     name: Optional[str] = None
 
 
@@ -81,98 +151,149 @@ class JoinRoomResponse(BaseModel):
     scene: str
 
 
-def _generate_code(length: int = 6) -> str:
-    return "".join(random.choices(string.ascii_uppercase + string.digits, k=length))
+class BatchRoomRequest(BaseModel):
+    codes: list[RoomCode] = Field(..., max_length=100)
 
 
-def _save_room_persistently(room: Room) -> None:
-    """Try to persist a room. If quota blocks writes, fall back to memory."""
+def _generate_code(length: int = 6) -> str:
+    # Base32 output is already uppercase A-Z2-7; 5 bits per character
+    raw = secrets.token_bytes((length * 5 + 7) // 8)
+    return base64.b32encode(raw).decode("ascii").rstrip("=")[:length]
+
+
+async def _save_room_persistently(room: RoomDoc) -> None:
+    """Persist a room and cache it. If quota blocks writes, keep only the cached copy."""
+    global _fallback_active
+    # Stamp here so the cached copy matches the stored document; BSON dates
+    # only keep milliseconds
+    now = datetime.now(timezone.utc)
+    now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+    room = {**room, "created_at": now, "updated_at": now}
     try:
-        create_document("room", room)
+        # The code doubles as _id, so the primary key index enforces uniqueness
+        await create_document("room", {"_id": room["code"], **room})
     except Exception as e:
         # Quota errors from Cosmos DB (Mongo API) include Forbidden/Quota exceeded
         if "Quota" in str(e) or "Forbidden" in str(e) or "quota" in str(e).lower():
-            FALLBACK_ROOMS[room.code] = room.model_dump()
+            _fallback_active = True
         else:
             raise
+    _ROOM_CACHE[room["code"]] = room
+
+
+async def _find_room(code: str) -> Optional[RoomDoc]:
+    cached = _ROOM_CACHE.get(code)
+    if cached is not None:
+        return cached
+    pending = _INFLIGHT.get(code)
+    if pending is None:
+        pending = asyncio.ensure_future(_load_room(code))
+        _INFLIGHT[code] = pending
+        pending.add_done_callback(lambda _: _INFLIGHT.pop(code, None))
+    # Shield so one cancelled waiter does not cancel the lookup for the others
+    return await asyncio.shield(pending)
 
 
-def _find_room(code: str) -> Optional[dict]:
-    # Try DB first
+async def _load_room(code: str) -> Optional[RoomDoc]:
     try:
+        db = database.db
         if db is not None:
-            doc = db["room"].find_one({"code": code})
+            # Query code, not _id: legacy rooms are stored under an ObjectId _id
+            doc = await db["room"].find_one({"code": code}, {"_id": 0})
             if doc:
+                _ROOM_CACHE[code] = doc
                 return doc
     except Exception:
         pass
-    # Fallback memory
-    return FALLBACK_ROOMS.get(code)
+    return None
 
 
-@app.post("/rooms", response_model=CreateRoomResponse)
-def create_room(payload: CreateRoomRequest):
+async def _track_participant(code: str, name: Optional[str]) -> None:
     try:
-        # Generate unique code
+        participant = Participant(room_code=code, name=name)
+        await create_document("participant", participant)
+    except Exception:
+        pass
+
+
+# Responses are built by the server itself, so response models are documentation only
+@app.post("/rooms", response_model=None, responses={200: {"model": CreateRoomResponse}})
+async def create_room(payload: CreateRoomRequest) -> dict[str, str]:
+    try:
+        # Payload is already validated, so build the Room document directly
+        scene = payload.scene or "classroom"
+        max_participants = payload.max_participants or 16
+        # Insert optimistically; a duplicate key means the code is taken
         for _ in range(10):
             code = _generate_code()
-            # Check both DB and fallback to ensure uniqueness
-            unique = True
+            if code in _ROOM_CACHE:
+                continue
+            room = {"code": code, "scene": scene, "is_active": True, "max_participants": max_participants}
             try:
-                if db is not None and db["room"].find_one({"code": code}) is not None:
-                    unique = False
-            except Exception:
-                pass
-            if code in FALLBACK_ROOMS:
-                unique = False
-            if unique:
-                break
+                await _save_room_persistently(room)
+            except DuplicateKeyError:
+                continue
+            break
         else:
             raise RuntimeError("Failed to generate unique room code")
 
-        room = Room(code=code, scene=payload.scene or "classroom", max_participants=payload.max_participants or 16)
-        _save_room_persistently(room)
-        return CreateRoomResponse(code=code, scene=room.scene)
+        return {"code": code, "scene": scene}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Create room failed: {e}")
 
 
-@app.post("/rooms/join", response_model=JoinRoomResponse)
-def join_room(payload: JoinRoomRequest):
+@app.post("/rooms/join", response_model=None, responses={200: {"model": JoinRoomResponse}})
+async def join_room(payload: JoinRoomRequest, background_tasks: BackgroundTasks) -> dict[str, str]:
     try:
-        code = payload.code.upper()
-        doc = _find_room(code)
+        code = payload.code
+        doc = await _find_room(code)
         if not doc:
             raise HTTPException(status_code=404, detail="Room not found")
 
-        # Optionally track participant (best-effort)
-        try:
-            participant = Participant(room_code=code, name=payload.name)
-            create_document("participant", participant)
-        except Exception:
-            pass
+        # Track participant after the response is sent (best-effort)
+        background_tasks.add_task(_track_participant, code, payload.name)
 
-        return JoinRoomResponse(code=code, scene=doc.get("scene", "classroom"))
+        return {"code": code, "scene": doc.get("scene", "classroom")}
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Join failed: {e}")
 
 
-@app.get("/rooms/{code}")
-def get_room(code: str):
+@app.post("/rooms/batch", response_model=None)
+async def get_rooms_batch(payload: BatchRoomRequest) -> dict[str, RoomDoc]:
+    """Resolve many room codes in one call. Unknown codes are omitted."""
+    try:
+        rooms: dict[str, RoomDoc] = {}
+        missing: list[str] = []
+        for code in dict.fromkeys(payload.codes):
+            doc = _ROOM_CACHE.get(code)
+            if doc is not None:
+                rooms[code] = doc
+            else:
+                missing.append(code)
+
+        # One $in query for everything the cache could not answer; DB errors
+        # surface as 500 so they can't be mistaken for "no such rooms"
+        db = database.db
+        if missing and db is not None:
+            cursor = db["room"].find({"code": {"$in": missing}}, {"_id": 0})
+            for doc in await cursor.to_list(length=len(missing)):
+                _ROOM_CACHE[doc["code"]] = doc
+                rooms[doc["code"]] = doc
+        return rooms
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Batch fetch failed: {e}")
+
+
+@app.get("/rooms/{code}", response_model=None)
+async def get_room(code: str) -> RoomDoc:
     try:
+        # FastAPI 0.104 ignores AfterValidator on path params, so normalize here
         code = code.upper()
-        doc = _find_room(code)
+        doc = await _find_room(code)
         if not doc:
             raise HTTPException(status_code=404, detail="Room not found")
-        # Make JSON serializable if from DB
-        if isinstance(doc, dict) and "_id" in doc:
-            try:
-                from bson import ObjectId  # type: ignore
-                doc["_id"] = str(doc["_id"])  # noqa: F401
-            except Exception:
-                doc.pop("_id", None)
         return doc
     except HTTPException:
         raise
@@ -180,8 +301,25 @@ def get_room(code: str):
         raise HTTPException(status_code=500, detail=f"Fetch room failed: {e}")
 
 
+# Build the OpenAPI schema at import so `gunicorn --preload` shares it copy-on-write
+app.openapi()
+
+
 if __name__ == "__main__":
     import uvicorn
 
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop",
+        http="httptools",
+        # Longer keep-alive holds more idle sockets per worker but spares clients
+        # a TCP/TLS handshake per request; the deeper backlog absorbs bursts.
+        # limit_concurrency is left unset so slow DB calls don't cause 503s.
+        backlog=2048,
+        timeout_keep_alive=30,
+        workers=workers,
+    )
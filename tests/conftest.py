@@ -0,0 +1,108 @@
+import asyncio
+from types import SimpleNamespace
+
+import bson
+import pytest
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from fastapi.testclient import TestClient
+from pymongo.errors import DuplicateKeyError
+
+import database
+import main
+
+
+# Matches the tz_aware=True client opened in database.connect_db
+_CODEC_OPTIONS = CodecOptions(tz_aware=True)
+
+
+def _matches(doc: dict, filter_dict: dict) -> bool:
+    for key, value in filter_dict.items():
+        if isinstance(value, dict) and "$in" in value:
+            if doc.get(key) not in value["$in"]:
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+def _project(doc: dict, projection) -> dict:
+    doc = dict(doc)
+    if projection and projection.get("_id") == 0:
+        doc.pop("_id", None)
+    return doc
+
+
+class FakeCursor:
+    def __init__(self, docs: list):
+        self._docs = docs
+
+    async def to_list(self, length=None):
+        return self._docs[:length] if length else list(self._docs)
+
+
+class FakeCollection:
+    """Just enough of a Motor collection for the room endpoints"""
+
+    def __init__(self):
+        self.docs: list[dict] = []
+        self.queries: list[dict] = []
+        self.indexes: list[tuple] = []
+        # Tests can clear this to hold find_one until they release it
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    def find(self, filter_dict, projection=None):
+        self.queries.append(filter_dict)
+        return FakeCursor([_project(d, projection) for d in self.docs if _matches(d, filter_dict)])
+
+    async def find_one(self, filter_dict, projection=None):
+        self.queries.append(filter_dict)
+        await self.gate.wait()
+        for doc in self.docs:
+            if _matches(doc, filter_dict):
+                return _project(doc, projection)
+        return None
+
+    async def insert_one(self, doc):
+        doc = dict(doc)
+        doc.setdefault("_id", ObjectId())
+        # Store what MongoDB would hand back, e.g. datetimes cut to milliseconds
+        doc = bson.decode(bson.encode(doc), codec_options=_CODEC_OPTIONS)
+        if any(d["_id"] == doc["_id"] for d in self.docs):
+            raise DuplicateKeyError("E11000 duplicate key error")
+        self.docs.append(doc)
+        return SimpleNamespace(inserted_id=doc["_id"])
+
+    async def create_index(self, keys, **kwargs):
+        self.indexes.append((keys, kwargs))
+        return f"{keys}_1"
+
+
+class FakeDB:
+    def __init__(self):
+        self.collections: dict[str, FakeCollection] = {}
+        self.list_calls = 0
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return self.collections.setdefault(name, FakeCollection())
+
+    async def list_collection_names(self):
+        self.list_calls += 1
+        return list(self.collections)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeDB()
+    monkeypatch.setattr(database, "db", fake)
+    monkeypatch.setattr(main, "_fallback_active", False)
+    main._ROOM_CACHE.clear()
+    main._INFLIGHT.clear()
+    main._COLLECTIONS_CACHE.clear()
+    return fake
+
+
+@pytest.fixture
+def client(db):
+    return TestClient(main.app)
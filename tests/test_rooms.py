@@ -0,0 +1,247 @@
+import asyncio
+
+from bson import ObjectId
+from cachetools import TTLCache
+from fastapi.testclient import TestClient
+
+import database
+import main
+
+
+def test_get_room_is_case_insensitive(client):
+    code = client.post("/rooms", json={}).json()["code"]
+
+    response = client.get(f"/rooms/{code.lower()}")
+
+    assert response.status_code == 200
+    assert response.json()["code"] == code
+
+
+def test_join_room_is_case_insensitive(client):
+    code = client.post("/rooms", json={"scene": "space"}).json()["code"]
+
+    response = client.post("/rooms/join", json={"code": code.lower(), "name": "Ada"})
+
+    assert response.status_code == 200
+    assert response.json() == {"code": code, "scene": "space"}
+
+
+def test_startup_creates_unique_code_index(db, monkeypatch):
+    monkeypatch.setattr(database, "connect_db", lambda: db)
+    monkeypatch.setattr(database, "close_db", lambda: None)
+
+    with TestClient(main.app) as client:
+        client.get("/")
+
+    assert ("code", {"unique": True}) in db["room"].indexes
+
+
+def test_slow_index_creation_does_not_block_startup(db, monkeypatch):
+    async def hang(*args, **kwargs):
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(database, "connect_db", lambda: db)
+    monkeypatch.setattr(database, "close_db", lambda: None)
+    monkeypatch.setattr(db["room"], "create_index", hang)
+
+    with TestClient(main.app) as client:
+        assert client.get("/").status_code == 200
+
+
+def test_index_creation_failure_is_logged(db, monkeypatch, caplog):
+    async def refuse(*args, **kwargs):
+        raise Exception("unique index cannot be created on a non-empty collection")
+
+    monkeypatch.setattr(database, "connect_db", lambda: db)
+    monkeypatch.setattr(database, "close_db", lambda: None)
+    monkeypatch.setattr(db["room"], "create_index", refuse)
+
+    with TestClient(main.app) as client:
+        client.get("/")
+
+    assert "Could not create unique index on room.code" in caplog.text
+
+
+def test_legacy_room_with_object_id_is_found(client, db):
+    db["room"].docs.append({"_id": ObjectId(), "code": "OLD123", "scene": "nature", "is_active": True, "max_participants": 16})
+
+    assert client.get("/rooms/old123").json()["scene"] == "nature"
+    main._ROOM_CACHE.clear()
+    assert client.post("/rooms/join", json={"code": "OLD123"}).json() == {"code": "OLD123", "scene": "nature"}
+    main._ROOM_CACHE.clear()
+    assert list(client.post("/rooms/batch", json={"codes": ["OLD123"]}).json()) == ["OLD123"]
+
+
+def test_unknown_code_costs_one_query(client, db):
+    assert client.get("/rooms/NOPE22").status_code == 404
+    assert db["room"].queries == [{"code": "NOPE22"}]
+
+
+def test_cached_and_stored_room_are_identical(client):
+    code = client.post("/rooms", json={}).json()["code"]
+
+    from_cache = client.get(f"/rooms/{code}").json()
+    main._ROOM_CACHE.clear()
+    from_db = client.get(f"/rooms/{code}").json()
+
+    assert from_cache == from_db
+    assert set(from_db) == {"code", "scene", "is_active", "max_participants", "created_at", "updated_at"}
+
+
+def test_zero_max_participants_falls_back_to_default(client):
+    code = client.post("/rooms", json={"max_participants": 0}).json()["code"]
+
+    assert client.get(f"/rooms/{code}").json()["max_participants"] == 16
+
+
+def test_out_of_range_max_participants_is_rejected(client):
+    assert client.post("/rooms", json={"max_participants": 65}).status_code == 422
+    assert client.post("/rooms", json={"max_participants": -1}).status_code == 422
+
+
+def _stored_room(db, code, scene="classroom"):
+    db["room"].docs.append({"_id": code, "code": code, "scene": scene, "is_active": True, "max_participants": 16})
+
+
+def test_concurrent_misses_share_one_query(db):
+    _stored_room(db, "ABC234", "space")
+
+    async def scenario():
+        db["room"].gate = asyncio.Event()
+        lookups = [asyncio.ensure_future(main._find_room("ABC234")) for _ in range(20)]
+        await asyncio.sleep(0)
+        db["room"].gate.set()
+        return await asyncio.gather(*lookups)
+
+    results = asyncio.run(scenario())
+
+    assert len(db["room"].queries) == 1
+    assert all(doc["scene"] == "space" for doc in results)
+    assert "ABC234" in main._ROOM_CACHE
+    assert not main._INFLIGHT
+
+
+def test_cancelled_waiter_does_not_cancel_shared_lookup(db):
+    _stored_room(db, "ABC234")
+
+    async def scenario():
+        db["room"].gate = asyncio.Event()
+        first = asyncio.ensure_future(main._find_room("ABC234"))
+        second = asyncio.ensure_future(main._find_room("ABC234"))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        db["room"].gate.set()
+        return first, await second
+
+    first, doc = asyncio.run(scenario())
+
+    assert first.cancelled()
+    assert doc["code"] == "ABC234"
+    assert len(db["room"].queries) == 1
+
+
+def test_batch_serves_cache_then_single_in_query(client, db):
+    cached = client.post("/rooms", json={}).json()["code"]
+    _stored_room(db, "DBONLY", "nature")
+    db["room"].queries.clear()
+
+    response = client.post("/rooms/batch", json={"codes": [cached.lower(), "dbonly", "DBONLY", "NOPE22"]})
+
+    assert response.status_code == 200
+    assert set(response.json()) == {cached, "DBONLY"}
+    assert response.json()["DBONLY"]["scene"] == "nature"
+    assert db["room"].queries == [{"code": {"$in": ["DBONLY", "NOPE22"]}}]
+    assert "DBONLY" in main._ROOM_CACHE
+
+
+def test_handlers_do_not_revalidate_responses():
+    routes = [r for r in main.app.routes if getattr(r, "endpoint", None) and r.endpoint.__module__ == "main"]
+
+    assert routes
+    assert all(route.response_model is None for route in routes)
+
+
+def test_quota_error_keeps_room_in_memory(client, db, monkeypatch):
+    async def over_quota(doc):
+        raise Exception("Request rate is large. Quota exceeded")
+
+    monkeypatch.setattr(db["room"], "insert_one", over_quota)
+
+    response = client.post("/rooms", json={"scene": "space"})
+    assert response.status_code == 200
+    code = response.json()["code"]
+
+    assert client.post("/rooms/join", json={"code": code}).json() == {"code": code, "scene": "space"}
+    assert client.get("/test").json()["fallback_active"] is True
+    assert not db["room"].docs
+
+
+def test_non_quota_insert_error_fails_create(client, db, monkeypatch):
+    async def broken(doc):
+        raise Exception("connection reset")
+
+    monkeypatch.setattr(db["room"], "insert_one", broken)
+
+    response = client.post("/rooms", json={})
+
+    assert response.status_code == 500
+    assert client.get("/test").json()["fallback_active"] is False
+    assert not main._ROOM_CACHE
+
+
+def test_batch_db_error_is_500_not_empty(client, db, monkeypatch):
+    def broken(*args, **kwargs):
+        raise Exception("connection reset")
+
+    monkeypatch.setattr(db["room"], "find", broken)
+
+    response = client.post("/rooms/batch", json={"codes": ["ABC234"]})
+
+    assert response.status_code == 500
+    assert response.json()["detail"].startswith("Batch fetch failed")
+
+
+def test_join_records_participant_in_background(client, db):
+    code = client.post("/rooms", json={}).json()["code"]
+
+    client.post("/rooms/join", json={"code": code.lower(), "name": "Ada"})
+
+    participants = db["participant"].docs
+    assert len(participants) == 1
+    assert participants[0]["room_code"] == code
+    assert participants[0]["name"] == "Ada"
+
+
+def test_participant_write_failure_does_not_fail_join(client, db, monkeypatch):
+    code = client.post("/rooms", json={}).json()["code"]
+
+    async def broken(doc):
+        raise Exception("connection reset")
+
+    monkeypatch.setattr(db["participant"], "insert_one", broken)
+
+    assert client.post("/rooms/join", json={"code": code}).status_code == 200
+
+
+def test_health_probes_share_one_collection_listing(client, db):
+    db["room"]  # registers the collection with the fake
+
+    responses = [client.get("/test").json() for _ in range(5)]
+
+    assert db.list_calls == 1
+    assert all(r["collections"] == ["room"] for r in responses)
+
+
+def test_collection_listing_refreshes_after_ttl(client, db, monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(main, "_COLLECTIONS_CACHE", TTLCache(maxsize=1, ttl=5, timer=lambda: now[0]))
+
+    client.get("/test")
+    now[0] = 4.9
+    client.get("/test")
+    assert db.list_calls == 1
+
+    now[0] = 5.1
+    client.get("/test")
+    assert db.list_calls == 2